@@ -8,12 +8,16 @@
 # disabled.
 
 if True: # imports
+    import signal
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN) # don't die if ~/bin/profile runs before profiler.init
     import evdev
     from evdev import InputDevice, categorize, ecodes
     from Lib.DS3231 import DS3231
+    import dis
+    import errno
     import math
     from optparse import OptionParser
-    from select import select
+    from select import select, error as select_error
     import RPi.GPIO as GPIO
     import smbus
     import socket
@@ -269,7 +273,19 @@ class dispatcher(object): # class is not instantiated
     @classmethod
     def update(cls):
         global timestamp
-        r, w, x = select(cls.read_files, cls.write_files, cls.excpt_files, cls.poll_interval)
+        deadline = time.time() + cls.poll_interval
+        timeout = cls.poll_interval
+        while True:
+            try:
+                r, w, x = select(cls.read_files, cls.write_files, cls.excpt_files, timeout)
+                break
+            except select_error as e: # select is not restarted after a signal (e.g. profiler timer)
+                if e.args[0] != errno.EINTR:
+                    raise
+                timeout = deadline - time.time() # resume the poll, don't cut it short
+                if timeout <= 0.0:
+                    r = ()
+                    break
         timestamp = time.time()
         for fileno in r:
             cls.server_dict[fileno].service(fileno)
@@ -587,16 +603,127 @@ class net(object): # class not instantiated
         else:
             return False
 
+class profiler(object): # class not instantiated
+    # Sampling profiler for the live process, toggled on and off by SIGUSR1
+    # (see ~/bin/profile).  While running, a timer signal samples the main
+    # thread's stack; samples are counted by the chain of telescope.py lines
+    # and written on stop as collapsed stacks ("frame;frame;frame count"),
+    # which flamegraph.pl and similar tools read directly.  While off, nothing
+    # is done beyond having the SIGUSR1 handler installed.
+    running = False
+    interval = 0.01 # seconds
+    output = '/var/log/telescope_profile.txt'
+    
+    # constants
+    max_depth = 16 # telescope.py frames kept per sample, innermost first
+    max_stacks = 256 # distinct stacks counted before overflowing into other_key
+    other_key = (-1,)
+    
+    # static variables
+    filename = ''
+    labels = dict() # 'class.function' by telescope.py line number
+    stack = [0] * max_depth # line numbers of the current sample, 0 past the outermost
+    counts = dict() # sample count by tuple(stack), or by other_key
+    
+    @classmethod
+    def init(cls, output, interval):
+        cls.output = output
+        cls.interval = interval
+        cls.filename = sys._getframe().f_code.co_filename
+        # build the line number labels now, so sampling does no name lookups
+        for name, obj in globals().items():
+            if isinstance(obj, type):
+                for attr_name, attr in obj.__dict__.items():
+                    if isinstance(attr, (classmethod, staticmethod)):
+                        attr = attr.__func__
+                    code = getattr(attr, '__code__', None)
+                    if code is not None and code.co_filename == cls.filename:
+                        for offset, line in dis.findlinestarts(code):
+                            cls.labels[line] = '%s.%s' % (name, code.co_name)
+        signal.signal(signal.SIGUSR1, cls.toggle)
+        signal.siginterrupt(signal.SIGUSR1, False)
+    
+    @classmethod
+    def toggle(cls, signum, frame):
+        if cls.running:
+            cls.stop()
+        else:
+            cls.start()
+    
+    @classmethod
+    def start(cls):
+        cls.counts.clear()
+        signal.signal(signal.SIGALRM, cls.sample)
+        signal.siginterrupt(signal.SIGALRM, False) # restart i2c and other system calls
+        try:
+            signal.setitimer(signal.ITIMER_REAL, cls.interval, cls.interval)
+        except signal.ItimerError:
+            signal.signal(signal.SIGALRM, signal.SIG_IGN)
+            debug.special_message = 'profiler start failed'
+            return
+        cls.running = True
+        debug.special_message = 'profiler started'
+    
+    @classmethod
+    def stop(cls):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        cls.running = False
+        try:
+            cls.write()
+            debug.special_message = 'profiler stopped'
+        except IOError:
+            debug.special_message = 'profiler write failed'
+    
+    @classmethod
+    def sample(cls, signum, frame):
+        stack = cls.stack
+        depth = 0
+        while frame is not None and depth < cls.max_depth:
+            if frame.f_code.co_filename == cls.filename:
+                stack[depth] = frame.f_lineno
+                depth += 1
+            frame = frame.f_back
+        while depth < cls.max_depth:
+            stack[depth] = 0
+            depth += 1
+        key = tuple(stack)
+        if key not in cls.counts and len(cls.counts) >= cls.max_stacks:
+            key = cls.other_key
+        cls.counts[key] = cls.counts.get(key, 0) + 1
+    
+    @classmethod
+    def write(cls):
+        with open(cls.output, 'w') as f:
+            for key, count in cls.counts.items():
+                if key is cls.other_key:
+                    f.write('<other> %d\n' % count)
+                    continue
+                frames = ['%s:%d' % (cls.labels.get(line, '<module>'), line) for line in key if line]
+                frames.reverse() # outermost first
+                f.write('%s %d\n' % (';'.join(frames), count))
+
 class options(object): # class is not instantiated
     parser = OptionParser()
     parser.add_option("-D", "--debug",
                       action="store_true", dest="debug", default=False,
                       help="print debug messages to stdout")
+    parser.add_option("--profile-output",
+                      dest="profile_output", default=profiler.output,
+                      help="collapsed-stack file written when profiling is stopped by SIGUSR1")
+    parser.add_option("--profile-interval", type="float",
+                      dest="profile_interval", default=profiler.interval,
+                      help="profiler sampling interval in seconds")
     (_options, args) = parser.parse_args()
+    if _options.profile_interval <= 0.0:
+        parser.error("--profile-interval must be positive")
     debug = _options.debug
+    profile_output = _options.profile_output
+    profile_interval = _options.profile_interval
 
 if __name__ == '__main__':
     debug.init(options.debug)
+    profiler.init(options.profile_output, options.profile_interval)
     my_subprocess = subprocess.Popen(['/usr/bin/aplay', '-q', '/home/lvaas/sound/startup.wav'])
     pad.init()
     net.init()